@@ -8,19 +8,28 @@ MIT License
 
 import os
 import sys
+import atexit
 import json
+import pickle
 import yaml
 import time
 import re
 import logging
+import logging.handlers
+import queue
 import urllib.parse
 import secrets
 import webbrowser
+import tempfile
+import hashlib
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Generator, Tuple
-from dataclasses import dataclass, field, asdict
-from functools import wraps
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 import threading
 
 from flask import (
@@ -33,22 +42,94 @@ from flask import (
     session,
     redirect,
     url_for,
+    send_file,
 )
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 优先使用 libyaml 提供的 C 解析器，不可用时回退到纯 Python 实现
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# orjson 为可选依赖，未安装时回退到标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 删除文件名中非法字符的转换表
+_FILENAME_BAD = str.maketrans("", "", '<>:"/\\|?*')
+# workspace_state.json 开头的 created_at 字段
+_STATE_CREATED_AT = re.compile(rb'\{\s*"created_at"\s*:\s*"([^"\\]*)"')
 
 # ==================== 配置和日志 ====================
 
 CONFIG_FILE = "config.yml"
 DEBUG_LOG = "debug.log"
+# 读取LLM流式响应时每次从socket读取的最大字节数
+LLM_STREAM_CHUNK_SIZE = 8192
+# SSE内容合并：首个增量立即发送，之后每次发送阈值按倍数增长直到上限；
+# 距上次发送超过间隔时即使未达阈值也会发送
+SSE_BATCH_INITIAL_CHARS = 1
+SSE_BATCH_MAX_CHARS = 64
+SSE_BATCH_GROWTH_FACTOR = 2
+SSE_BATCH_INTERVAL = 0.02  # 秒
+# 读取 agents.md 主题时只扫描文件头部的字节数（Theme 行位于文件开头）
+AGENTS_HEADER_SIZE = 4096
+# 读取状态文件中的创建时间时先尝试的文件头部字节数（created_at 是第一个字段）
+STATE_HEADER_SIZE = 256
+# 后台写盘线程被唤醒后等待的秒数，期间的多次保存合并为一次写入
+SAVE_DEBOUNCE_INTERVAL = 0.5
+# 教学阶段系统提示词快照的会话边界：空闲超过该秒数或使用超过该轮数后重新采集
+BOOTSTRAP_IDLE_SECONDS = 30 * 60
+BOOTSTRAP_MAX_TURNS = 20
+# 内存中保留的工作区数量上限，超出时淘汰最久未访问的工作区
+ACTIVE_WORKSPACE_LIMIT = 32
+# 系统提示词中最近对话（最近10条消息）的字符预算
+RECENT_EXCHANGES_CHAR_BUDGET = 5000
+# 超过该长度的重复工具结果在发送给LLM时替换为对首次结果的引用
+TOOL_RESULT_DEDUP_MIN_CHARS = 200
+
+# 设置环境变量 APP_DEBUG=1 时输出DEBUG日志，默认只记录INFO及以上
+LOG_LEVEL = logging.DEBUG if os.environ.get("APP_DEBUG") else logging.INFO
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    配置异步日志
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(DEBUG_LOG, encoding="utf-8"),
-        logging.StreamHandler(sys.stdout),
-    ],
-)
+    业务线程只把日志记录放入队列，格式化和文件/控制台输出
+    由QueueListener的后台线程完成。日志文件按10MB轮转，保留3份，
+    且直到第一次写入时才打开。
+    """
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    file_handler = logging.handlers.RotatingFileHandler(
+        DEBUG_LOG,
+        maxBytes=10_000_000,
+        backupCount=3,
+        encoding="utf-8",
+        delay=True,
+    )
+    stream_handler = logging.StreamHandler(sys.stdout)
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(LOG_LEVEL)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    # 退出时写完队列中剩余的日志
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
@@ -147,10 +228,120 @@ def clean_content(content: str) -> str:
     return cleaned
 
 
+def write_bytes_atomic(path: str, data: bytes):
+    """
+    原子写入文件：先写入同目录下的临时文件，再通过os.replace替换目标文件
+
+    临时文件由 tempfile.mkstemp 创建，每次调用的文件名都不同，多个线程或进程
+    同时写入同一文件时互不干扰；写入失败时清理临时文件并重新抛出异常。
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=os.path.basename(path) + ".",
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_yaml_cached(path: str) -> Any:
+    """
+    加载YAML文件，并使用按修改时间失效的pickle旁路缓存
+
+    解析结果会写入 ``<path>.cache.pkl``，下次启动时如果源文件的
+    修改时间和大小未变，直接反序列化缓存，跳过YAML解析。
+
+    Args:
+        path: YAML文件路径
+
+    Returns:
+        解析后的数据
+    """
+    st = os.stat(path)
+    cache_path = path + ".cache.pkl"
+    cache_key = (st.st_mtime_ns, st.st_size)
+
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, data = pickle.load(f)
+        if cached_key == cache_key:
+            return data
+    except Exception:
+        pass
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = yaml.load(f, Loader=YamlLoader)
+
+    # 原子写入，避免并发启动的进程读到半截缓存
+    try:
+        write_bytes_atomic(
+            cache_path,
+            pickle.dumps((cache_key, data), protocol=pickle.HIGHEST_PROTOCOL),
+        )
+    except OSError as e:
+        logger.debug(f"写入YAML缓存失败: {str(e)}")
+
+    return data
+
+
+def dump_json_bytes(obj: Any) -> bytes:
+    """将对象序列化为带缩进的UTF-8 JSON字节串（不转义非ASCII字符）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def dump_json_compact(obj: Any) -> bytes:
+    """将对象序列化为紧凑的UTF-8 JSON字节串（不转义非ASCII字符）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def dump_json_text(obj: Any) -> str:
+    """将对象序列化为紧凑的JSON字符串（不转义非ASCII字符），用于消息内容"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads_json(data: Any) -> Any:
+    """解析JSON字符串或字节串"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def sse_event(obj: Any) -> bytes:
+    """将对象编码为一条SSE data帧"""
+    if orjson is not None:
+        return b"data: " + orjson.dumps(obj) + b"\n\n"
+    return f"data: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def load_json_file(path: str) -> Any:
+    """一次性读取并解析JSON文件"""
+    with open(path, "rb") as f:
+        return loads_json(f.read())
+
+
 # ==================== 数据模型 ====================
 
+# Python 3.10+ 使用 __slots__ 数据类，减少实例内存并加快属性访问
+_DATACLASS_OPTIONS: Dict[str, Any] = (
+    {"slots": True} if sys.version_info >= (3, 10) else {}
+)
 
-@dataclass
+
+@dataclass(**_DATACLASS_OPTIONS)
 class Message:
     role: str
     content: str
@@ -159,7 +350,7 @@ class Message:
     tool_call_id: Optional[str] = None
 
 
-@dataclass
+@dataclass(**_DATACLASS_OPTIONS)
 class Workspace:
     id: str
     theme: str
@@ -171,6 +362,46 @@ class Workspace:
     messages: List[Dict[str, Any]] = field(default_factory=list)
     compressed_context: str = ""
     last_wait_call_id: Optional[str] = None  # 上次 wait_user_answer 的 call_id
+    # 教学阶段系统提示词的固定输入快照（保持前缀不变以命中KV Cache），只保存在内存中
+    bootstrap_snapshot: Optional[Dict[str, str]] = None
+    # 当前快照已使用的轮数和最后使用时间（time.monotonic），用于判断会话边界
+    bootstrap_turns: int = 0
+    bootstrap_used_at: float = 0.0
+    # compact_workspace_messages 的增量结果：精简后的消息、
+    # 已出现过的工具结果内容 -> 首次的 tool_call_id
+    compacted_messages: List[Dict[str, Any]] = field(default_factory=list, repr=False)
+    compacted_first_ids: Dict[str, str] = field(default_factory=dict, repr=False)
+    # 解析符号链接后的工作区根目录，用于路径越界检查
+    real_path: str = field(default="", repr=False)
+    # real_path 加路径分隔符（已做大小写规范化），工作区内的路径都以它开头
+    real_prefix: str = field(default="", repr=False)
+
+    def __post_init__(self):
+        if not self.real_path:
+            self.real_path = os.path.realpath(self.path)
+        if not self.real_prefix:
+            self.real_prefix = os.path.join(os.path.normcase(self.real_path), "")
+
+
+def resolve_workspace_path(workspace: Workspace, rel_path: str) -> Optional[str]:
+    """
+    将相对路径解析为工作区内的真实路径
+
+    使用realpath解析 ``..`` 和符号链接后，确认结果仍以工作区根目录为前缀。
+
+    Args:
+        workspace: 工作区
+        rel_path: 相对于工作区根目录的路径
+
+    Returns:
+        解析后的绝对路径；越出工作区时返回None
+    """
+    full_path = os.path.realpath(os.path.join(workspace.real_path, rel_path))
+    if full_path == workspace.real_path:
+        return full_path
+    if not os.path.normcase(full_path).startswith(workspace.real_prefix):
+        return None
+    return full_path
 
 
 # ==================== 配置管理 ====================
@@ -181,6 +412,25 @@ class ConfigManager:
 
     def __init__(self):
         self.config = self._load_config()
+        # 配置加载后不再变化，常用的配置项预先取出
+        self._llm_config: Dict[str, Any] = self.config.get("llm", {})
+        self._search_config: Dict[str, Any] = self.config.get("search", {})
+        self._workspace_root = os.path.abspath(
+            self.config.get("workspace_root", "./workspaces")
+        )
+        # 模型名 -> 最大上下文（tokens），重名时以第一个配置为准
+        self._model_max_context: Dict[str, int] = {}
+        for model in self._llm_config.get("models", []):
+            self._model_max_context.setdefault(
+                model.get("name"), model.get("max_context", 128) * 1000
+            )
+        # 默认模型的上下文压缩阈值（最大上下文的80%）
+        self._default_token_threshold = int(
+            self.get_model_max_context(
+                self._llm_config.get("default_model", "gpt-4o")
+            )
+            * 0.8
+        )
 
     def _load_config(self) -> Dict[str, Any]:
         """加载配置文件"""
@@ -190,8 +440,7 @@ class ConfigManager:
             sys.exit(1)
 
         try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                config = yaml.safe_load(f)
+            config = load_yaml_cached(CONFIG_FILE)
             logger.info("配置文件加载成功")
             return config
         except Exception as e:
@@ -200,24 +449,23 @@ class ConfigManager:
 
     def get_llm_config(self) -> Dict[str, Any]:
         """获取LLM配置"""
-        return self.config.get("llm", {})
+        return self._llm_config
 
     def get_search_config(self) -> Dict[str, Any]:
         """获取搜索配置"""
-        return self.config.get("search", {})
+        return self._search_config
 
     def get_workspace_root(self) -> str:
         """获取工作区根目录"""
-        root = self.config.get("workspace_root", "./workspaces")
-        return os.path.abspath(root)
+        return self._workspace_root
 
     def get_model_max_context(self, model_name: str) -> int:
         """获取模型最大上下文"""
-        models = self.config.get("llm", {}).get("models", [])
-        for model in models:
-            if model.get("name") == model_name:
-                return model.get("max_context", 128) * 1000
-        return 128000  # 默认128K
+        return self._model_max_context.get(model_name, 128000)  # 默认128K
+
+    def get_default_token_threshold(self) -> int:
+        """获取默认模型的上下文压缩阈值"""
+        return self._default_token_threshold
 
 
 config_manager = ConfigManager()
@@ -225,13 +473,116 @@ config_manager = ConfigManager()
 # ==================== 工作区管理 ====================
 
 
+@lru_cache(maxsize=128)
+def _read_text_cached(path: str, mtime_ns: int, size: int) -> str:
+    """读取文本文件（以修改时间和大小作为缓存键，文件变化后自动失效）"""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+@lru_cache(maxsize=256)
+def _read_exercise_cached(path: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    """读取并解析练习题文件（以修改时间和大小作为缓存键，返回的字典不可修改）"""
+    return load_json_file(path)
+
+
+def format_transcript(messages: List[Dict[str, Any]], limit: int) -> str:
+    """将消息格式化为 "role: content" 文本行，每条内容截断到limit个字符"""
+    return "\n".join(
+        f"{m['role']}: {m['content'][:limit]}" for m in messages
+    )
+
+
+def select_recent_exchanges(messages: List[Dict[str, Any]], budget: int) -> str:
+    """
+    从最新的消息开始保留原文，直到用完字符预算，按时间顺序格式化为 "role: content" 文本
+
+    只删减原文而不做摘要（文件路径、代码等细节保持原样）：丢弃空行和没有内容的消息，
+    预算不足时最早保留的那条消息只截取末尾部分。
+    """
+    lines = []
+    remaining = budget
+    for m in reversed(messages):
+        if remaining <= 0:
+            break
+        content = "\n".join(
+            line for line in m["content"].splitlines() if line.strip()
+        )
+        if not content:
+            continue
+        if len(content) > remaining:
+            lines.append(f"{m['role']}: …{content[-remaining:]}")
+            break
+        lines.append(f"{m['role']}: {content}")
+        remaining -= len(content)
+    lines.reverse()
+    return "\n".join(lines)
+
+
+def compact_workspace_messages(workspace: "Workspace") -> List[Dict[str, Any]]:
+    """
+    精简发送给LLM的历史：与之前某条工具结果完全相同的工具消息，内容替换为对首次结果的引用
+
+    只替换重复的工具输出（如多次读取同一文件），其余消息原样保留；消息本身不删除，
+    保证 assistant 的 tool_calls 仍有对应的 tool 消息。较早的消息不受后续消息影响，
+    请求前缀保持稳定。历史只会追加，结果缓存在工作区上，每次只处理新增的消息。
+    token_count 即精简后历史（实际发送给LLM的内容）的估算，在这里随新增消息累加，
+    前端显示和压缩触发使用同一个数值。返回的列表之后还会增长，需要快照时由调用方复制。
+    """
+    compacted = workspace.compacted_messages
+    first_ids = workspace.compacted_first_ids
+    new_messages = []
+    for m in islice(workspace.messages, len(compacted), None):
+        if m.get("role") == "tool" and len(m["content"]) > TOOL_RESULT_DEDUP_MIN_CHARS:
+            first_id = first_ids.get(m["content"])
+            if first_id is None:
+                first_ids[m["content"]] = m.get("tool_call_id", "")
+            else:
+                m = dict(m, content=dump_json_text({"duplicate_of": first_id}))
+        new_messages.append(m)
+    if new_messages:
+        compacted.extend(new_messages)
+        workspace.token_count += estimate_token_count(new_messages)
+    return compacted
+
+
+def estimate_token_count(messages: List[Dict[str, Any]]) -> int:
+    """估算消息列表的token数（每4个字符约1个token）"""
+    return sum(len(m["content"]) // 4 for m in messages)
+
+
 class WorkspaceManager:
     """工作区管理器"""
 
     def __init__(self):
         self.root = config_manager.get_workspace_root()
         self._ensure_root()
-        self.active_workspaces: Dict[str, Workspace] = {}
+        # 按访问顺序排列的已加载工作区（LRU），数量超过上限时淘汰最久未访问的
+        self.active_workspaces: "OrderedDict[str, Workspace]" = OrderedDict()
+        self._active_lock = threading.Lock()
+        # 正在被流式响应或后台任务使用的工作区: workspace_id -> 使用者数量，使用中不会被淘汰
+        self._in_use: Dict[str, int] = {}
+        # list_workspaces 缓存: workspace_id -> (agents.md mtime, theme, created_at)
+        self._list_cache: Dict[str, Tuple[float, str, str]] = {}
+        # 完整列表结果缓存: (根目录mtime_ns, 列表, ETag)，根目录未变化时直接返回
+        self._list_result: Optional[Tuple[int, List[Dict[str, Any]], str]] = None
+        # 每次失效时递增，防止失效前开始的扫描把旧结果写回缓存
+        self._list_generation = 0
+
+        # 后台保存: workspace_id -> (path, messages, 消息数, state) 快照
+        self._pending_saves: Dict[
+            str, Tuple[str, List[Dict[str, Any]], int, Dict]
+        ] = {}
+        # history.jsonl 中已写入的消息数；None表示需要整体重写
+        self._persisted_counts: Dict[str, Optional[int]] = {}
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._save_event = threading.Event()
+        self._save_thread = threading.Thread(
+            target=self._save_loop, name="workspace-saver", daemon=True
+        )
+        self._save_thread.start()
+        atexit.register(self.flush)
 
     def _ensure_root(self):
         """确保工作区根目录存在"""
@@ -241,11 +592,30 @@ class WorkspaceManager:
     def _sanitize_filename(self, name: str) -> str:
         """清理文件名"""
         # 移除非法字符
-        name = re.sub(r'[<>:"/\\|?*]', "", name)
+        name = name.translate(_FILENAME_BAD)
         # 限制长度
         name = name[:50].strip()
         return name
 
+    def _read_theme(self, agents_path: str, default: str) -> str:
+        """从agents.md头部读取主题，读取失败或未找到时返回默认值
+
+        直接在字节串中查找 ``Theme:`` 行，只解码该行内容。
+        """
+        try:
+            with open(agents_path, "rb") as f:
+                header = f.read(AGENTS_HEADER_SIZE)
+        except OSError:
+            return default
+
+        start = header.find(b"Theme:")
+        if start < 0:
+            return default
+        start += len(b"Theme:")
+        end = header.find(b"\n", start)
+        theme = header[start : end if end >= 0 else None]
+        return theme.decode("utf-8", "replace").strip() or default
+
     def create_workspace(self, theme: str) -> Workspace:
         """创建新工作区"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -253,9 +623,8 @@ class WorkspaceManager:
         workspace_id = f"{timestamp}_{theme_slug}"
 
         path = os.path.join(self.root, workspace_id)
-        os.makedirs(path, exist_ok=True)
 
-        # 创建子目录
+        # 创建子目录（工作区目录随之创建）
         os.makedirs(os.path.join(path, "notes"), exist_ok=True)
         os.makedirs(os.path.join(path, "exercises"), exist_ok=True)
 
@@ -264,18 +633,44 @@ class WorkspaceManager:
             theme=theme,
             created_at=datetime.now().isoformat(),
             path=path,
-            token_threshold=int(
-                config_manager.get_model_max_context(
-                    config_manager.get_llm_config().get("default_model", "gpt-4o")
-                )
-                * 0.8
-            ),
+            token_threshold=config_manager.get_default_token_threshold(),
         )
 
-        self.active_workspaces[workspace_id] = workspace
+        self._register_workspace(workspace)
+        # 立即写入状态文件，持久化创建时间
+        self.save_workspace(workspace)
+        self.invalidate_list_cache()
         logger.info(f"创建工作区: {workspace_id}")
         return workspace
 
+    def _load_history(self, path: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        读取历史消息，返回 (消息列表, history.jsonl 是否完整)
+
+        history.jsonl 每行一条消息；进程中断可能留下不完整的末行，解析到该行时停止。
+        没有 history.jsonl 时读取旧版的 history.json（下次保存时转换为新格式）。
+        """
+        jsonl_path = os.path.join(path, "history.jsonl")
+        try:
+            with open(jsonl_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            legacy_path = os.path.join(path, "history.json")
+            if os.path.exists(legacy_path):
+                return load_json_file(legacy_path), False
+            return [], False
+
+        messages = []
+        for line in data.split(b"\n"):
+            if not line:
+                continue
+            try:
+                messages.append(loads_json(line))
+            except ValueError:
+                logger.warning(f"历史消息文件末尾不完整，已忽略: {jsonl_path}")
+                return messages, False
+        return messages, True
+
     def _sanitize_messages(
         self, messages: List[Dict[str, Any]]
     ) -> List[Dict[str, Any]]:
@@ -340,20 +735,91 @@ class WorkspaceManager:
 
         return sanitized
 
+    def _ctime_isoformat(self, path: str) -> str:
+        """以目录ctime作为创建时间（兼容未记录created_at的旧工作区）"""
+        return datetime.fromtimestamp(os.path.getctime(path)).isoformat()
+
+    def _read_created_at(self, workspace_id: str, path: str) -> str:
+        """获取工作区创建时间：优先内存中的工作区，其次状态文件，最后目录ctime"""
+        workspace = self.active_workspaces.get(workspace_id)
+        if workspace:
+            return workspace.created_at
+
+        state_path = os.path.join(path, "workspace_state.json")
+        try:
+            # 状态文件可能包含较大的压缩上下文，先只读取头部的created_at
+            with open(state_path, "rb") as f:
+                match = _STATE_CREATED_AT.match(f.read(STATE_HEADER_SIZE))
+            if match:
+                created_at = match.group(1).decode("utf-8")
+            else:
+                created_at = load_json_file(state_path).get("created_at")
+        except Exception:
+            created_at = None
+        return created_at or self._ctime_isoformat(path)
+
     def get_workspace(self, workspace_id: str) -> Optional[Workspace]:
-        """获取工作区"""
-        if workspace_id in self.active_workspaces:
-            return self.active_workspaces[workspace_id]
+        """获取工作区（已加载的工作区直接从内存返回，只在首次访问时读取磁盘）"""
+        with self._active_lock:
+            workspace = self.active_workspaces.get(workspace_id)
+            if workspace is not None:
+                self.active_workspaces.move_to_end(workspace_id)
+                return workspace
 
         # 尝试从磁盘加载
         path = os.path.join(self.root, workspace_id)
         if os.path.exists(path):
-            workspace = self._load_workspace_from_disk(workspace_id, path)
+            # 持有写锁读取，确保后台线程正在写入的保存已经完成
+            with self._write_lock:
+                self._flush_locked()
+                workspace = self._load_workspace_from_disk(workspace_id, path)
             if workspace:
-                self.active_workspaces[workspace_id] = workspace
-                return workspace
+                return self._register_workspace(workspace)
         return None
 
+    def acquire_workspace(self, workspace_id: str):
+        """标记工作区正在使用，release_workspace 之前不会被移出内存"""
+        with self._active_lock:
+            self._in_use[workspace_id] = self._in_use.get(workspace_id, 0) + 1
+
+    def release_workspace(self, workspace_id: str):
+        """释放 acquire_workspace 的标记"""
+        with self._active_lock:
+            remaining = self._in_use.get(workspace_id, 0) - 1
+            if remaining > 0:
+                self._in_use[workspace_id] = remaining
+            else:
+                self._in_use.pop(workspace_id, None)
+
+    def _register_workspace(self, workspace: Workspace) -> Workspace:
+        """
+        登记已加载的工作区，返回实际登记的实例
+
+        并发的首次请求可能各自加载了一份，只保留最先登记的实例，
+        保证同一工作区的所有请求修改的是同一个对象。
+        """
+        with self._active_lock:
+            existing = self.active_workspaces.get(workspace.id)
+            if existing is not None:
+                self.active_workspaces.move_to_end(workspace.id)
+                return existing
+            self.active_workspaces[workspace.id] = workspace
+            excess = len(self.active_workspaces) - ACTIVE_WORKSPACE_LIMIT
+            if excess > 0:
+                # 正在使用或有未写盘保存的工作区不淘汰，否则再次访问时会加载出第二个实例
+                with self._pending_lock:
+                    evictable = [
+                        wid
+                        for wid in self.active_workspaces
+                        if wid != workspace.id
+                        and wid not in self._in_use
+                        and wid not in self._pending_saves
+                    ]
+                for evicted_id in evictable[:excess]:
+                    del self.active_workspaces[evicted_id]
+                    logger.debug(f"从内存中移除工作区: {evicted_id}")
+            return workspace
+
     def _load_workspace_from_disk(
         self, workspace_id: str, path: str
     ) -> Optional[Workspace]:
@@ -361,153 +827,311 @@ class WorkspaceManager:
         try:
             # 读取agents.md获取基本信息
             agents_path = os.path.join(path, "agents.md")
-            theme = workspace_id  # 默认使用ID作为主题
-
-            if os.path.exists(agents_path):
-                with open(agents_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    # 尝试提取主题
-                    match = re.search(r"Theme:\s*(.+)", content)
-                    if match:
-                        theme = match.group(1).strip()
+            # 默认使用ID作为主题
+            theme = self._read_theme(agents_path, workspace_id)
 
             # 读取历史消息
-            history_path = os.path.join(path, "history.json")
-            messages = []
-            if os.path.exists(history_path):
-                with open(history_path, "r", encoding="utf-8") as f:
-                    messages = json.load(f)
+            messages, history_intact = self._load_history(path)
 
             # 读取工作区状态
             state_path = os.path.join(path, "workspace_state.json")
             current_phase = "inquiry"  # 默认值
-            token_count = 0
-            token_threshold = int(
-                config_manager.get_model_max_context(
-                    config_manager.get_llm_config().get("default_model", "gpt-4o")
-                )
-                * 0.8
-            )
+            token_threshold = config_manager.get_default_token_threshold()
             compressed_context = ""
+            created_at = None
 
             last_wait_call_id = None
             if os.path.exists(state_path):
                 try:
-                    with open(state_path, "r", encoding="utf-8") as f:
-                        state = json.load(f)
-                        current_phase = state.get("current_phase", "inquiry")
-                        token_count = state.get("token_count", 0)
-                        token_threshold = state.get("token_threshold", token_threshold)
-                        compressed_context = state.get("compressed_context", "")
-                        last_wait_call_id = state.get("last_wait_call_id")
+                    state = load_json_file(state_path)
+                    current_phase = state.get("current_phase", "inquiry")
+                    token_threshold = state.get("token_threshold", token_threshold)
+                    compressed_context = state.get("compressed_context", "")
+                    last_wait_call_id = state.get("last_wait_call_id")
+                    created_at = state.get("created_at")
                 except Exception as e:
                     logger.error(f"加载工作区状态失败: {str(e)}")
 
+            # 旧版本工作区没有记录创建时间，使用目录的ctime
+            if not created_at:
+                created_at = self._ctime_isoformat(path)
+
             # 清理异常的消息历史（确保以 user 消息开始，以 assistant 消息结束）
+            loaded_count = len(messages)
             messages = self._sanitize_messages(messages)
-
+            # 磁盘上的历史与内存一致时，之后的保存只需追加新消息；否则下次保存时整体重写
+            self._persisted_counts[workspace_id] = (
+                len(messages)
+                if history_intact and len(messages) == loaded_count
+                else None
+            )
             workspace = Workspace(
                 id=workspace_id,
                 theme=theme,
-                created_at=datetime.fromtimestamp(os.path.getctime(path)).isoformat(),
+                created_at=created_at,
                 path=path,
                 current_phase=current_phase,
                 messages=messages,
-                token_count=token_count,
                 token_threshold=token_threshold,
                 compressed_context=compressed_context,
                 last_wait_call_id=last_wait_call_id,
             )
 
+            # 清理可能删除了消息，加载时按实际历史计算一次token数，之后增量累加
+            compact_workspace_messages(workspace)
+
             logger.info(f"从磁盘加载工作区: {workspace_id}")
             return workspace
         except Exception as e:
             logger.error(f"加载工作区失败: {str(e)}")
             return None
 
+    def invalidate_list_cache(self):
+        """使完整的工作区列表缓存失效（新建工作区或agents.md被修改后调用）"""
+        self._list_generation += 1
+        self._list_result = None
+
     def list_workspaces(self) -> List[Dict[str, Any]]:
         """列出所有工作区"""
+        return self.list_workspaces_with_etag()[0]
+
+    def list_workspaces_with_etag(self) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        列出所有工作区，同时返回标识该列表版本的ETag
+
+        根目录的mtime未变化（没有新建或删除工作区）时直接返回上次的结果；
+        否则重新扫描，agents.md未变化的工作区复用缓存的主题和创建时间。
+        """
+        try:
+            root_mtime = os.stat(self.root).st_mtime_ns
+        except OSError:
+            root_mtime = -1
+        cached_result = self._list_result
+        if cached_result is not None and cached_result[0] == root_mtime:
+            return list(cached_result[1]), cached_result[2]
+        generation = self._list_generation
+
         workspaces = []
+        seen = set()
         try:
-            for item in os.listdir(self.root):
-                item_path = os.path.join(self.root, item)
-                if os.path.isdir(item_path):
-                    # 读取agents.md获取主题
-                    theme = item
-                    agents_path = os.path.join(item_path, "agents.md")
-                    if os.path.exists(agents_path):
-                        with open(agents_path, "r", encoding="utf-8") as f:
-                            content = f.read()
-                            match = re.search(r"Theme:\s*(.+)", content)
-                            if match:
-                                theme = match.group(1).strip()
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if not entry.is_dir():
+                        continue
+                    item = entry.name
+                    seen.add(item)
+
+                    # agents.md 未变化时直接复用缓存的主题和创建时间
+                    agents_path = os.path.join(entry.path, "agents.md")
+                    try:
+                        agents_mtime = os.stat(agents_path).st_mtime
+                    except OSError:
+                        agents_mtime = -1.0
+
+                    cached = self._list_cache.get(item)
+                    if cached and cached[0] == agents_mtime:
+                        theme, created_at = cached[1], cached[2]
+                    else:
+                        # 读取agents.md获取主题
+                        theme = (
+                            self._read_theme(agents_path, item)
+                            if agents_mtime >= 0
+                            else item
+                        )
+                        created_at = self._read_created_at(item, entry.path)
+                        self._list_cache[item] = (agents_mtime, theme, created_at)
 
                     workspaces.append(
                         {
                             "id": item,
                             "theme": theme,
-                            "created_at": datetime.fromtimestamp(
-                                os.path.getctime(item_path)
-                            ).isoformat(),
-                            "path": item_path,
+                            "created_at": created_at,
+                            "path": entry.path,
                         }
                     )
         except Exception as e:
             logger.error(f"列出工作区失败: {str(e)}")
 
+        # 清理已删除工作区的缓存（并发的列表请求可能同时清理或写入，遍历快照并容忍已删除的键）
+        for stale in list(self._list_cache):
+            if stale not in seen:
+                self._list_cache.pop(stale, None)
+
         # 按创建时间排序（最新的在前）
         workspaces.sort(key=lambda x: x["created_at"], reverse=True)
-        return workspaces
+        # ETag由列表内容计算，进程重启后同一ETag仍对应同样的内容
+        etag = hashlib.blake2b(dump_json_compact(workspaces), digest_size=16).hexdigest()
+        if generation == self._list_generation:
+            self._list_result = (root_mtime, workspaces, etag)
+        return list(workspaces), etag
 
     def save_workspace(self, workspace: Workspace):
-        """保存工作区状态"""
+        """保存工作区状态
+
+        只在调用线程中生成消息和状态的快照，实际写盘由后台线程完成；
+        同一工作区的多次保存会合并，只写入最新的快照。
+        """
+        state = {
+            "created_at": workspace.created_at,
+            "current_phase": workspace.current_phase,
+            "token_count": workspace.token_count,
+            "token_threshold": workspace.token_threshold,
+            "compressed_context": workspace.compressed_context,
+            "last_wait_call_id": workspace.last_wait_call_id,
+        }
+        # 消息只会追加，记录当前条数即可，后台线程按条数截取
+        snapshot = (workspace.path, workspace.messages, len(workspace.messages), state)
+        with self._pending_lock:
+            self._pending_saves[workspace.id] = snapshot
+        self._save_event.set()
+
+    def flush(self):
+        """立即写入所有待保存的工作区（进程退出时自动调用）"""
+        with self._write_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        """写入所有待保存的工作区（调用方需持有 _write_lock）"""
+        with self._pending_lock:
+            pending = self._pending_saves
+            self._pending_saves = {}
+
+        for workspace_id, (path, messages, count, state) in pending.items():
+            try:
+                # 保存历史消息
+                self._write_history(workspace_id, path, messages, count)
+                # 保存工作区状态（包括阶段信息）
+                write_bytes_atomic(
+                    os.path.join(path, "workspace_state.json"),
+                    dump_json_bytes(state),
+                )
+                logger.debug(f"工作区已保存: {workspace_id}")
+            except Exception as e:
+                logger.error(f"保存工作区失败: {str(e)}")
+
+    def _write_history(
+        self,
+        workspace_id: str,
+        path: str,
+        messages: List[Dict[str, Any]],
+        count: int,
+    ):
+        """将前count条消息写入history.jsonl：通常只追加新消息，必要时整体重写"""
+        history_path = os.path.join(path, "history.jsonl")
+        persisted = self._persisted_counts.get(workspace_id)
+        # 写入失败时文件内容不确定，保持None使下次保存整体重写
+        self._persisted_counts[workspace_id] = None
+        if persisted is not None and persisted <= count:
+            if persisted < count:
+                with open(history_path, "ab") as f:
+                    f.write(
+                        b"".join(
+                            dump_json_compact(m) + b"\n"
+                            for m in messages[persisted:count]
+                        )
+                    )
+        else:
+            write_bytes_atomic(
+                history_path,
+                b"".join(dump_json_compact(m) + b"\n" for m in messages[:count]),
+            )
+            # 已转换为新格式，删除旧版历史文件
+            legacy_path = os.path.join(path, "history.json")
+            if os.path.exists(legacy_path):
+                os.remove(legacy_path)
+        self._persisted_counts[workspace_id] = count
+
+    def _save_loop(self):
+        """后台写盘线程：收到保存请求后稍等片刻，把连续的多次保存合并为一次写入"""
+        while True:
+            self._save_event.wait()
+            time.sleep(SAVE_DEBOUNCE_INTERVAL)
+            self._save_event.clear()
+            self.flush()
+
+    def _iter_files(
+        self, dir_path: str, rel_dir: str = "", depth: int = 0
+    ) -> Generator[Dict[str, Any], None, None]:
+        """递归扫描目录，逐个生成文件信息
+
+        先生成当前目录的文件再进入子目录（与os.walk顺序一致），
+        文件大小直接取自DirEntry.stat()，不再额外stat。
+        """
         try:
-            # 保存历史消息
-            history_path = os.path.join(workspace.path, "history.json")
-            with open(history_path, "w", encoding="utf-8") as f:
-                json.dump(workspace.messages, f, ensure_ascii=False, indent=2)
-
-            # 保存工作区状态（包括阶段信息）
-            state_path = os.path.join(workspace.path, "workspace_state.json")
-            state = {
-                "current_phase": workspace.current_phase,
-                "token_count": workspace.token_count,
-                "token_threshold": workspace.token_threshold,
-                "compressed_context": workspace.compressed_context,
-                "last_wait_call_id": workspace.last_wait_call_id,
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            return
+
+        # 层级为相对目录中的分隔符数量（根目录及一级子目录均为0）
+        level = max(depth - 1, 0)
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir():
+                # 与os.walk一致：不进入符号链接目录
+                if not entry.is_symlink():
+                    subdirs.append(entry)
+                continue
+            # 统一使用正斜杠作为路径分隔符（跨平台兼容）
+            yield {
+                "name": entry.name,
+                "path": f"{rel_dir}{entry.name}",
+                "level": level,
+                "size": entry.stat().st_size,
             }
-            with open(state_path, "w", encoding="utf-8") as f:
-                json.dump(state, f, ensure_ascii=False, indent=2)
 
-            logger.debug(f"工作区已保存: {workspace.id}")
-        except Exception as e:
-            logger.error(f"保存工作区失败: {str(e)}")
+        for entry in subdirs:
+            yield from self._iter_files(
+                entry.path, f"{rel_dir}{entry.name}/", depth + 1
+            )
+
+    def read_cached(self, workspace_id: str, rel_path: str) -> str:
+        """读取工作区内的文本文件，内容按mtime缓存；文件不存在时返回空字符串"""
+        path = os.path.join(self.root, workspace_id, rel_path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return ""
+        return _read_text_cached(path, st.st_mtime_ns, st.st_size)
+
+    def read_exercise(
+        self, workspace_id: str, exercise_id: str
+    ) -> Optional[Dict[str, Any]]:
+        """读取练习题（按mtime缓存，调用方不得修改返回的字典）；不存在时返回None"""
+        filename = f"{exercise_id}.json"
+        # 练习题ID不能包含路径
+        if os.path.basename(filename) != filename:
+            return None
+        path = os.path.join(self.root, workspace_id, "exercises", filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return _read_exercise_cached(path, st.st_mtime_ns, st.st_size)
+
+    def read_exercise_meta(
+        self, workspace_id: str, exercise_id: str
+    ) -> Optional[Tuple[str, List[Any], str]]:
+        """读取练习题的 (type, correct_answers, explanation)；不存在时返回None"""
+        exercise = self.read_exercise(workspace_id, exercise_id)
+        if exercise is None:
+            return None
+        return (
+            exercise.get("type", "choice"),
+            exercise.get("correct_answers", []),
+            exercise.get("explanation", ""),
+        )
 
-    def get_file_tree(self, workspace_id: str) -> List[Dict[str, Any]]:
-        """获取工作区文件树"""
+    def get_file_tree(
+        self, workspace_id: str, limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """获取工作区文件树；指定limit时取到足够数量的文件后即停止扫描"""
         workspace = self.get_workspace(workspace_id)
         if not workspace:
             return []
 
         file_tree = []
         try:
-            for root, dirs, files in os.walk(workspace.path):
-                rel_path = os.path.relpath(root, workspace.path)
-                level = rel_path.count(os.sep) if rel_path != "." else 0
-
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    rel_file_path = os.path.relpath(file_path, workspace.path)
-                    # 统一使用正斜杠作为路径分隔符（跨平台兼容）
-                    rel_file_path = rel_file_path.replace("\\", "/")
-                    file_tree.append(
-                        {
-                            "name": file,
-                            "path": rel_file_path,
-                            "level": level,
-                            "size": os.path.getsize(file_path),
-                        }
-                    )
+            file_tree.extend(islice(self._iter_files(workspace.path), limit))
         except Exception as e:
             logger.error(f"获取文件树失败: {str(e)}")
 
@@ -516,6 +1140,27 @@ class WorkspaceManager:
 
 workspace_manager = WorkspaceManager()
 
+# ==================== HTTP客户端 ====================
+
+
+def create_http_session() -> requests.Session:
+    """
+    创建带连接池的HTTP会话，跨请求复用TCP/TLS连接
+
+    每个主机最多保留64个连接，覆盖32个工作线程加后台压缩任务的并发。
+    只重试建立连接阶段的失败（请求尚未发出，重试不会导致LLM请求重复执行）。
+    """
+    session = requests.Session()
+    retries = Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.2)
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# LLM服务和搜索工具共享的HTTP会话
+http_session = create_http_session()
+
 # ==================== 工具系统 ====================
 
 
@@ -535,12 +1180,14 @@ class ToolExecutor:
         self, tool_name: str, params: Dict[str, Any], workspace: Workspace
     ) -> Dict[str, Any]:
         """执行工具"""
-        if tool_name not in self.tools:
+        try:
+            handler = self.tools[tool_name]
+        except KeyError:
             return {"error": f"未知工具: {tool_name}"}
 
         try:
             logger.info(f"执行工具: {tool_name}")
-            return self.tools[tool_name](params, workspace)
+            return handler(params, workspace)
         except Exception as e:
             logger.error(f"工具执行失败 {tool_name}: {str(e)}")
             return {"error": str(e)}
@@ -618,8 +1265,8 @@ class ToolExecutor:
         exercise_path = os.path.join(workspace.path, "exercises", f"{exercise_id}.json")
 
         try:
-            with open(exercise_path, "w", encoding="utf-8") as f:
-                json.dump(exercise, f, ensure_ascii=False, indent=2)
+            with open(exercise_path, "wb") as f:
+                f.write(dump_json_bytes(exercise))
             logger.info(f"练习题已保存: {exercise_id}")
             return {"success": True, "exercise_id": exercise_id, "exercise": exercise}
         except Exception as e:
@@ -656,7 +1303,7 @@ class ToolExecutor:
         self, query: str, api_key: str, max_results: int
     ) -> Dict[str, Any]:
         """Tavily搜索"""
-        response = requests.post(
+        response = http_session.post(
             "https://api.tavily.com/search",
             headers={"Content-Type": "application/json"},
             json={
@@ -688,7 +1335,7 @@ class ToolExecutor:
     ) -> Dict[str, Any]:
         """Jina AI搜索"""
         headers = {"Authorization": f"Bearer {api_key}"}
-        response = requests.get(
+        response = http_session.get(
             f"https://s.jina.ai/http://{urllib.parse.quote(query)}",
             headers=headers,
             timeout=30,
@@ -711,7 +1358,7 @@ class ToolExecutor:
     ) -> Dict[str, Any]:
         """Brave搜索"""
         headers = {"X-Subscription-Token": api_key}
-        response = requests.get(
+        response = http_session.get(
             "https://api.search.brave.com/res/v1/web/search",
             headers=headers,
             params={"q": query, "count": max_results},
@@ -775,8 +1422,8 @@ class ToolExecutor:
             }
 
         # 确保路径安全（限制在工作区内）
-        full_path = os.path.normpath(os.path.join(workspace.path, path))
-        if not full_path.startswith(workspace.path):
+        full_path = resolve_workspace_path(workspace, path)
+        if full_path is None:
             return {"error": "非法路径", "hint": "路径必须在工作区内"}
 
         try:
@@ -801,21 +1448,44 @@ class ToolExecutor:
                         "error": f"文件不存在: {path}",
                         "hint": "请检查路径是否正确",
                     }
-                with open(full_path, "r", encoding="utf-8") as f:
-                    original = f.read()
-                # 简单的替换逻辑（实际应用中可以更复杂）
-                try:
-                    old_text = edit_instruction.split("->")[0].strip()
-                    new_text = edit_instruction.split("->")[1].strip()
-                    modified = original.replace(old_text, new_text)
-                except IndexError:
+                # 只按第一个"->"分割，新文本中可以包含"->"
+                parts = edit_instruction.split("->", 1)
+                old_text = parts[0].strip()
+                if len(parts) != 2 or not old_text:
                     return {
                         "error": "edit_instruction格式错误",
                         "hint": "格式应为：原文本->新文本",
                     }
-                with open(full_path, "w", encoding="utf-8") as f:
-                    f.write(modified)
-                return {"success": True, "message": f"文件已编辑: {path}"}
+                new_text = parts[1].strip()
+
+                # 直接在UTF-8字节上查找和替换，不解码整个文件
+                with open(full_path, "rb") as f:
+                    original = f.read()
+                old_bytes = old_text.encode("utf-8")
+                new_bytes = new_text.encode("utf-8")
+                # 只替换第一处匹配，找到后不再扫描剩余内容
+                idx = original.find(old_bytes)
+                if idx < 0 and b"\r\n" in original and b"\n" in old_bytes:
+                    # CRLF换行的文件，按CRLF重新匹配多行文本
+                    old_bytes = old_bytes.replace(b"\n", b"\r\n")
+                    new_bytes = new_bytes.replace(b"\n", b"\r\n")
+                    idx = original.find(old_bytes)
+                if idx < 0:
+                    return {
+                        "error": f"原文本未找到: {old_text[:50]}",
+                        "hint": "请先读取文件，确认原文本与文件内容完全一致",
+                    }
+                write_bytes_atomic(
+                    full_path,
+                    b"".join(
+                        (original[:idx], new_bytes, original[idx + len(old_bytes) :])
+                    ),
+                )
+                return {
+                    "success": True,
+                    "message": f"文件已编辑: {path}",
+                    "replacements": 1,
+                }
 
             elif action == "delete":
                 if os.path.exists(full_path):
@@ -835,6 +1505,10 @@ class ToolExecutor:
 
         except Exception as e:
             return {"error": str(e), "hint": "请检查参数格式是否正确"}
+        finally:
+            # 写入类操作可能修改了agents.md中的主题，工作区列表需要重新检查
+            if action in ("write", "edit", "delete"):
+                workspace_manager.invalidate_list_cache()
 
     def _end_inquiry(
         self, params: Dict[str, Any], workspace: Workspace
@@ -872,9 +1546,211 @@ class ToolExecutor:
 
 tool_executor = ToolExecutor()
 
+# 同一轮中的多个web_search调用互不依赖，在此线程池中并发发出
+_search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="web-search")
+
+# ==================== 工具定义 ====================
+
+# 询问阶段可用的工具（仅end_inquiry）
+INQUIRY_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "end_inquiry",
+            "description": "结束需求询问阶段，表示已收集足够信息可以生成学习计划",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "summary": {
+                        "type": "string",
+                        "description": "对收集到的学习需求的简要总结",
+                    }
+                },
+                "required": ["summary"],
+            },
+        },
+    }
+]
+
+# 教学阶段可用的工具
+TEACHING_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "wait_user_answer",
+            "description": "Call this tool at the end of EVERY response to indicate you are waiting for the user's input. This tool MUST be called after you finish speaking, even if you have called other tools. Do not call this tool before you finish your response.",
+            "parameters": {
+                "type": "object",
+                "properties": {},
+                "required": [],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "generate_exercise",
+            "description": "Generate a practice exercise for the student. After calling this tool, you MUST continue the conversation based on the exercise generated, either by presenting the exercise to the student or asking if they are ready to answer.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "type": {
+                        "type": "string",
+                        "enum": [
+                            "fill_blank",
+                            "choice",
+                            "short_answer",
+                            "match",
+                            "multi_fill",
+                        ],
+                        "description": "The type of exercise: choice (multiple choice), fill_blank, short_answer, match, or multi_fill",
+                    },
+                    "question": {
+                        "type": "string",
+                        "description": "The complete question text. Must be detailed and clear.",
+                    },
+                    "options": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "For choice questions, provide at least 2 options. Required when type is 'choice'.",
+                    },
+                    "blanks": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "For fill_blank questions, list the blank positions. Required when type is 'fill_blank'.",
+                    },
+                    "correct_answers": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Array of correct answers. Required for all question types.",
+                    },
+                    "explanation": {
+                        "type": "string",
+                        "description": "Detailed explanation of the answer. Must explain why the correct answer is right.",
+                    },
+                    "difficulty": {
+                        "type": "string",
+                        "enum": ["easy", "medium", "hard"],
+                        "description": "Difficulty level: easy, medium, or hard",
+                    },
+                },
+                "required": ["type", "question", "correct_answers", "explanation"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "file_system",
+            "description": "Read, write, edit, delete files or create directories in the workspace. After calling this tool, you MUST tell the user what you did with the file.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "action": {
+                        "type": "string",
+                        "enum": ["read", "write", "edit", "delete", "mkdir"],
+                        "description": "The operation to perform: 'read' (read file), 'write' (create/write file), 'edit' (modify file), 'delete' (remove file), 'mkdir' (create directory). Must be lowercase English.",
+                    },
+                    "path": {
+                        "type": "string",
+                        "description": "The file or directory path relative to the workspace root. Required.",
+                    },
+                    "content": {
+                        "type": "string",
+                        "description": "The content to write. Required when action is 'write'.",
+                    },
+                    "edit_instruction": {
+                        "type": "string",
+                        "description": "Edit instruction in format 'old_text->new_text'. Only the first occurrence of old_text is replaced. Required when action is 'edit'.",
+                    },
+                },
+                "required": ["action", "path"],
+            },
+        },
+    },
+]
+
+# 网络搜索工具（仅在搜索功能已配置时提供）
+WEB_SEARCH_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "web_search",
+        "description": "Search the web for information. After calling this tool, you MUST summarize the search results and continue the conversation.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "The search query. Must be specific and clear.",
+                },
+                "max_results": {
+                    "type": "integer",
+                    "default": 5,
+                    "description": "Maximum number of results to return (1-10)",
+                },
+            },
+            "required": ["query"],
+        },
+    },
+}
+
+TEACHING_TOOLS_WITH_SEARCH = TEACHING_TOOLS + [WEB_SEARCH_TOOL]
+
+# SSE响应的固定头部（Connection等逐跳头部由WSGI服务器负责，不能由应用设置）
+SSE_CONTENT_TYPE = "text/event-stream; charset=utf-8"
+SSE_HEADERS = (("Cache-Control", "no-cache"), ("X-Accel-Buffering", "no"))
+
+# 预编码的固定SSE帧
+SSE_DONE = b"data: [DONE]\n\n"
+# end_inquiry 参数解析或执行失败时，仍然标记询问完成
+_END_INQUIRY_FALLBACK = {"inquiry_complete": True, "summary": "AI已收集足够信息"}
+SSE_END_INQUIRY_FALLBACK = sse_event(
+    {
+        "tool_call": {
+            "name": "end_inquiry",
+            "status": "completed",
+            "result": _END_INQUIRY_FALLBACK,
+        }
+    }
+) + sse_event(_END_INQUIRY_FALLBACK)
+
 # ==================== LLM服务 ====================
 
 
+class ContentBatcher:
+    """合并LLM流式内容增量，减少发往前端的SSE帧数"""
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._size = 0
+        self._threshold = SSE_BATCH_INITIAL_CHARS
+        self._last_flush = time.monotonic()
+
+    def add(self, content: str) -> Optional[str]:
+        """追加内容，达到发送条件时返回合并后的内容，否则返回None"""
+        self._parts.append(content)
+        self._size += len(content)
+        if (
+            self._size >= self._threshold
+            or time.monotonic() - self._last_flush >= SSE_BATCH_INTERVAL
+        ):
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """取出所有缓冲内容（没有内容时返回None）"""
+        if not self._parts:
+            return None
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        self._threshold = min(
+            self._threshold * SSE_BATCH_GROWTH_FACTOR, SSE_BATCH_MAX_CHARS
+        )
+        self._last_flush = time.monotonic()
+        return text
+
+
 class LLMService:
     """LLM服务"""
 
@@ -892,13 +1768,28 @@ class LLMService:
             "Content-Type": "application/json",
         }
 
+    def _error_message(self, response: requests.Response) -> str:
+        """从非200响应中提取错误信息"""
+        error_msg = f"LLM API错误: {response.status_code}"
+        try:
+            error_data = response.json()
+            error_msg += f" - {error_data.get('error', {}).get('message', '')}"
+        except:
+            error_msg += f" - {response.text[:200]}"
+        return error_msg
+
     def chat_completion(
         self,
         messages: List[Dict[str, str]],
         stream: bool = True,
         tools: Optional[List[Dict]] = None,
-    ) -> Generator[str, None, None]:
-        """聊天补全（流式）"""
+    ) -> Generator[Dict[str, Any], None, None]:
+        """
+        聊天补全（流式）
+
+        逐个生成解析后的响应数据块（流式时为每条SSE data事件）。
+        收到[DONE]或响应结束时生成器结束；请求失败时生成 {"error": 错误信息}。
+        """
         url = f"{self.base_url}/chat/completions"
 
         payload = {
@@ -912,8 +1803,9 @@ class LLMService:
             payload["tools"] = tools
             payload["tool_choice"] = "auto"
 
+        response = None
         try:
-            response = requests.post(
+            response = http_session.post(
                 url,
                 headers=self._get_headers(),
                 json=payload,
@@ -922,38 +1814,44 @@ class LLMService:
             )
 
             if response.status_code != 200:
-                error_msg = f"LLM API错误: {response.status_code}"
-                try:
-                    error_data = response.json()
-                    error_msg += f" - {error_data.get('error', {}).get('message', '')}"
-                except:
-                    error_msg += f" - {response.text[:200]}"
+                error_msg = self._error_message(response)
                 logger.error(error_msg)
-                yield f"data: {json.dumps({'error': error_msg})}\n\n"
+                yield {"error": error_msg}
                 return
 
             if stream:
-                for line in response.iter_lines():
-                    if line:
-                        line = line.decode("utf-8")
-                        if line.startswith("data: "):
-                            data = line[6:]
-                            if data == "[DONE]":
-                                yield f"data: [DONE]\n\n"
-                                break
-                            try:
-                                chunk = json.loads(data)
-                                yield f"data: {json.dumps(chunk)}\n\n"
-                            except json.JSONDecodeError:
-                                continue
+                received_done = False
+                # 直接按字节分行并解析JSON（UTF-8字节可直接交给JSON解析器，无需先解码）
+                for line in response.iter_lines(
+                    chunk_size=LLM_STREAM_CHUNK_SIZE, delimiter=b"\n"
+                ):
+                    # 收到[DONE]后继续读完响应体，使连接能归还连接池
+                    if not line or received_done:
+                        continue
+                    line = line.rstrip(b"\r")
+                    if not line.startswith(b"data: "):
+                        continue
+                    payload = line[6:]
+                    if payload == b"[DONE]":
+                        received_done = True
+                        continue
+                    try:
+                        data = loads_json(payload)
+                    except ValueError:
+                        # 跳过无法解析的数据块
+                        continue
+                    if isinstance(data, dict):
+                        yield data
             else:
-                data = response.json()
-                yield f"data: {json.dumps(data)}\n\n"
-                yield f"data: [DONE]\n\n"
+                yield response.json()
 
         except Exception as e:
             logger.error(f"LLM请求失败: {str(e)}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield {"error": str(e)}
+        finally:
+            # 客户端提前断开时释放连接
+            if response is not None:
+                response.close()
 
     def compress_context(
         self, messages: List[Dict[str, str]], study_plan: str, agent_state: str
@@ -978,8 +1876,9 @@ Format: Structured markdown with clear headings.
 """
 
         # 添加最近的消息
-        for msg in messages[-10:]:
-            compression_prompt += f"\n{msg['role']}: {msg['content'][:500]}"
+        recent_messages = messages[-10:]
+        if recent_messages:
+            compression_prompt += "\n" + format_transcript(recent_messages, 500)
 
         compression_messages = [
             {"role": "system", "content": "You are a context compression assistant."},
@@ -987,7 +1886,7 @@ Format: Structured markdown with clear headings.
         ]
 
         try:
-            response = requests.post(
+            response = http_session.post(
                 f"{self.base_url}/chat/completions",
                 headers=self._get_headers(),
                 json={
@@ -1018,11 +1917,37 @@ llm_service = LLMService()
 # ==================== 提示词管理 ====================
 
 
+# 提示词模板中的占位符，如 {study_plan}（模板中的JSON示例等其他花括号不受影响）
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+@lru_cache(maxsize=16)
+def _split_template(template: str) -> Tuple[str, ...]:
+    """将模板切分为 文本、占位符名、文本…… 交替排列的片段（每个模板只解析一次）"""
+    return tuple(_PLACEHOLDER_RE.split(template))
+
+
+def fill_placeholders(template: str, values: Dict[str, Any]) -> str:
+    """一次性替换模板中的占位符，未提供值的占位符原样保留"""
+    parts = list(_split_template(template))
+    for i in range(1, len(parts), 2):
+        key = parts[i]
+        parts[i] = str(values[key]) if key in values else f"{{{key}}}"
+    return "".join(parts)
+
+
 class PromptManager:
     """提示词管理器"""
 
     def __init__(self):
-        self.prompts = self._load_prompts()
+        self._prompts: Optional[Dict[str, Any]] = None
+
+    @property
+    def prompts(self) -> Dict[str, Any]:
+        """提示词配置（首次访问时加载）"""
+        if self._prompts is None:
+            self._prompts = self._load_prompts()
+        return self._prompts
 
     def _load_prompts(self) -> Dict[str, Any]:
         """加载提示词配置"""
@@ -1032,8 +1957,7 @@ class PromptManager:
             return self._get_default_prompts()
 
         try:
-            with open(prompts_file, "r", encoding="utf-8") as f:
-                prompts = yaml.safe_load(f)
+            prompts = load_yaml_cached(prompts_file)
             logger.info("提示词配置加载成功")
             return prompts
         except Exception as e:
@@ -1179,12 +2103,8 @@ class PromptManager:
         if "max_context" in stable_kwargs:
             stable_kwargs["max_context"] = "128"  # 使用固定值
 
-        # 替换变量
-        for key, value in stable_kwargs.items():
-            placeholder = f"{{{key}}}"
-            prompt_template = prompt_template.replace(placeholder, str(value))
-
-        return prompt_template
+        # 替换变量（单次扫描，替换进来的内容中即使包含占位符也不会被再次替换）
+        return fill_placeholders(prompt_template, stable_kwargs)
 
     def get_end_phrase(self, phrase_type: str) -> str:
         """获取结束语"""
@@ -1245,28 +2165,25 @@ def chat(workspace_id):
 @app.route("/api/workspaces", methods=["GET"])
 @token_required
 def list_workspaces():
-    """列出所有工作区"""
-    workspaces = workspace_manager.list_workspaces()
-    return jsonify({"success": True, "workspaces": workspaces})
-
-
-@app.route("/api/workspaces", methods=["POST"])
-@token_required
-def create_workspace():
-    """创建工作区"""
-    data = request.json
-    theme = data.get("theme", "").strip()
-
-    if not theme:
-        return jsonify({"success": False, "error": "主题不能为空"}), 400
+    """列出所有工作区（列表未变化时返回304）"""
+    workspaces, etag = workspace_manager.list_workspaces_with_etag()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    response = jsonify({"success": True, "workspaces": workspaces})
+    response.set_etag(etag)
+    # 每次使用前向服务器验证ETag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
-    workspace = workspace_manager.create_workspace(theme)
 
-    # 初始化agents.md
-    agents_content = f"""# Learning Session Agent State
+# 新工作区 agents.md 的初始内容
+AGENTS_TEMPLATE = """# Learning Session Agent State
 
 Theme: {theme}
-Created: {workspace.created_at}
+Created: {created_at}
 
 ## Student Profile
 - Learning Goal: [To be filled]
@@ -1283,9 +2200,27 @@ Created: {workspace.created_at}
 ## Session Notes
 """
 
+
+@app.route("/api/workspaces", methods=["POST"])
+@token_required
+def create_workspace():
+    """创建工作区"""
+    data = request.json
+    theme = data.get("theme", "").strip()
+
+    if not theme:
+        return jsonify({"success": False, "error": "主题不能为空"}), 400
+
+    workspace = workspace_manager.create_workspace(theme)
+
+    # 初始化agents.md（编码后一次写入）
+    agents_content = AGENTS_TEMPLATE.format(
+        theme=theme, created_at=workspace.created_at
+    ).encode("utf-8")
     agents_path = os.path.join(workspace.path, "agents.md")
-    with open(agents_path, "w", encoding="utf-8") as f:
+    with open(agents_path, "wb") as f:
         f.write(agents_content)
+    workspace_manager.invalidate_list_cache()
 
     return jsonify(
         {
@@ -1299,6 +2234,18 @@ Created: {workspace.created_at}
     )
 
 
+def workspace_sse_response(workspace: Workspace, events: Generator) -> Response:
+    """返回SSE流式响应；响应关闭（包括客户端断开）之前工作区不会被移出内存"""
+    workspace_manager.acquire_workspace(workspace.id)
+    response = Response(
+        stream_with_context(events),
+        content_type=SSE_CONTENT_TYPE,
+        headers=SSE_HEADERS,
+    )
+    response.call_on_close(lambda: workspace_manager.release_workspace(workspace.id))
+    return response
+
+
 @app.route("/api/workspaces/<workspace_id>/inquiry", methods=["POST"])
 @token_required
 def inquiry_chat(workspace_id):
@@ -1320,49 +2267,22 @@ def inquiry_chat(workspace_id):
         messages.append({"role": msg["role"], "content": msg["content"]})
     messages.append({"role": "user", "content": user_input})
 
-    # 定义询问阶段可用的工具（仅end_inquiry）
-    inquiry_tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "end_inquiry",
-                "description": "结束需求询问阶段，表示已收集足够信息可以生成学习计划",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "summary": {
-                            "type": "string",
-                            "description": "对收集到的学习需求的简要总结",
-                        }
-                    },
-                    "required": ["summary"],
-                },
-            },
-        }
-    ]
-
     def generate():
         full_response = ""
         # 使用字典存储工具调用，按index合并
         tool_calls_dict = {}
+        # 工具参数分片，流结束后再拼接（避免每个分片都复制一次已累积的字符串）
+        tool_args_parts: Dict[int, List[str]] = {}
+        batcher = ContentBatcher()
 
-        for chunk in llm_service.chat_completion(
-            messages, stream=True, tools=inquiry_tools
+        for data in llm_service.chat_completion(
+            messages, stream=True, tools=INQUIRY_TOOLS
         ):
-            if not chunk.startswith("data: "):
-                continue
-
-            data_str = chunk[6:]
-            if data_str == "[DONE]":
-                break
-
-            try:
-                data = json.loads(data_str)
-            except:
-                continue
-
             if "error" in data:
-                yield f"data: {json.dumps({'error': data['error']})}\n\n"
+                pending = batcher.flush()
+                if pending:
+                    yield sse_event({'content': pending})
+                yield sse_event({'error': data['error']})
                 return
 
             if "choices" in data and len(data["choices"]) > 0:
@@ -1389,23 +2309,22 @@ def inquiry_chat(workspace_id):
                             tool_calls_dict[tc_index]["type"] = tc["type"]
                         if "function" in tc:
                             func = tc["function"]
-                            if "name" in func:
+                            # 部分服务在每个分片中重复发送名称（或发送null），只在首次出现时记录并通知
+                            if func.get("name") and not tool_calls_dict[tc_index][
+                                "function"
+                            ].get("name"):
                                 tool_calls_dict[tc_index]["function"]["name"] = func[
                                     "name"
                                 ]
                                 tool_name = func["name"]
+                                pending = batcher.flush()
+                                if pending:
+                                    yield sse_event({'content': pending})
                                 # 只发送工具开始状态，不发送inquiry_complete状态
-                                yield f"data: {json.dumps({'tool_call': {'name': tool_name, 'status': 'started'}})}\n\n"
+                                yield sse_event({'tool_call': {'name': tool_name, 'status': 'started'}})
                             if "arguments" in func:
-                                # 累积参数
-                                if (
-                                    "arguments"
-                                    not in tool_calls_dict[tc_index]["function"]
-                                ):
-                                    tool_calls_dict[tc_index]["function"][
-                                        "arguments"
-                                    ] = ""
-                                tool_calls_dict[tc_index]["function"]["arguments"] += (
+                                # 累积参数分片
+                                tool_args_parts.setdefault(tc_index, []).append(
                                     func["arguments"]
                                 )
 
@@ -1413,7 +2332,17 @@ def inquiry_chat(workspace_id):
                 content = delta.get("content", "")
                 if content:
                     full_response += content
-                    yield f"data: {json.dumps({'content': content})}\n\n"
+                    batched = batcher.add(content)
+                    if batched:
+                        yield sse_event({'content': batched})
+
+        pending = batcher.flush()
+        if pending:
+            yield sse_event({'content': pending})
+
+        # 拼接完整的工具参数
+        for tc_index, parts in tool_args_parts.items():
+            tool_calls_dict[tc_index]["function"]["arguments"] = "".join(parts)
 
         # 如果有工具调用，执行它们
         if tool_calls_dict:
@@ -1428,37 +2357,31 @@ def inquiry_chat(workspace_id):
                         if not params_str or params_str.strip() == "":
                             params_dict = {}
                         else:
-                            params_dict = json.loads(params_str)
+                            params_dict = loads_json(params_str)
 
                         result = tool_executor.execute(
                             "end_inquiry", params_dict, workspace
                         )
                         if result.get("inquiry_complete"):
                             # 发送工具调用完成状态
-                            yield f"data: {json.dumps({'tool_call': {'name': 'end_inquiry', 'status': 'completed', 'result': result}})}\n\n"
+                            yield sse_event({'tool_call': {'name': 'end_inquiry', 'status': 'completed', 'result': result}})
                             # 发送询问完成信号
-                            yield f"data: {json.dumps({'inquiry_complete': True, 'summary': result.get('summary', '')})}\n\n"
+                            yield sse_event({'inquiry_complete': True, 'summary': result.get('summary', '')})
                     except json.JSONDecodeError as e:
                         logger.error(
                             f"解析end_inquiry参数失败: {str(e)}, params: {params_str}"
                         )
                         # 即使解析失败，也标记询问完成
-                        yield f"data: {json.dumps({'tool_call': {'name': 'end_inquiry', 'status': 'completed', 'result': {'inquiry_complete': True, 'summary': 'AI已收集足够信息'}}})}\n\n"
-                        yield f"data: {json.dumps({'inquiry_complete': True, 'summary': 'AI已收集足够信息'})}\n\n"
+                        yield SSE_END_INQUIRY_FALLBACK
                     except Exception as e:
                         logger.error(f"执行end_inquiry工具失败: {str(e)}")
                         # 即使执行失败，也标记询问完成
-                        yield f"data: {json.dumps({'tool_call': {'name': 'end_inquiry', 'status': 'completed', 'result': {'inquiry_complete': True, 'summary': 'AI已收集足够信息'}}})}\n\n"
-                        yield f"data: {json.dumps({'inquiry_complete': True, 'summary': 'AI已收集足够信息'})}\n\n"
+                        yield SSE_END_INQUIRY_FALLBACK
 
-        yield f"data: {json.dumps({'done': True, 'full_response': full_response})}\n\n"
-        yield "data: [DONE]\n\n"
+        yield sse_event({'done': True, 'full_response': full_response})
+        yield SSE_DONE
 
-    return Response(
-        stream_with_context(generate()),
-        mimetype="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
-    )
+    return workspace_sse_response(workspace, generate())
 
 
 @app.route("/api/workspaces/<workspace_id>/plan", methods=["POST"])
@@ -1472,36 +2395,138 @@ def generate_study_plan(workspace_id):
     data = request.json
     inquiry_history = data.get("history", [])
 
-    # 构建询问总结
+    # 构建询问总结（每条消息限制长度）
     inquiry_summary = ""
-    for msg in inquiry_history:
-        inquiry_summary += f"\n{msg['role']}: {msg['content'][:200]}"  # 限制长度
+    if inquiry_history:
+        inquiry_summary = "\n" + format_transcript(inquiry_history, 200)
 
     # 使用提示词管理器构建提示词
     plan_prompt = prompt_manager.get_plan_generation_prompt(inquiry_summary)
 
     messages = [{"role": "system", "content": plan_prompt}]
+    plan_path = os.path.join(workspace.path, "study_plan.md")
 
-    response_chunks = []
-    for chunk in llm_service.chat_completion(messages, stream=False):
-        if chunk.startswith("data: ") and chunk != "data: [DONE]\n\n":
-            data = json.loads(chunk[6:])
-            if "choices" in data:
-                content = data["choices"][0]["message"]["content"]
-                response_chunks.append(content)
+    def generate():
+        # 计划内容边生成边写入临时文件，完整生成后再替换study_plan.md，
+        # 失败或客户端断开时不会留下半份计划；每次生成使用独立的临时文件，
+        # 同一工作区的并发请求互不覆盖
+        fd, tmp_path = tempfile.mkstemp(
+            dir=workspace.path, prefix="study_plan.", suffix=".tmp"
+        )
+        completed = False
+        batcher = ContentBatcher()
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for data in llm_service.chat_completion(messages, stream=True):
+                    if "error" in data:
+                        logger.error(f"生成学习计划失败: {data['error']}")
+                        yield sse_event({'error': data['error']})
+                        return
+
+                    if "choices" in data and len(data["choices"]) > 0:
+                        content = data["choices"][0].get("delta", {}).get("content", "")
+                        if content:
+                            f.write(content)
+                            batched = batcher.add(content)
+                            if batched:
+                                yield sse_event({'content': batched})
+
+            pending = batcher.flush()
+            if pending:
+                yield sse_event({'content': pending})
+
+            os.replace(tmp_path, plan_path)
+            completed = True
+        finally:
+            if not completed:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
 
-    study_plan = "".join(response_chunks)
+        # 更新工作区阶段，学习计划变化后重新生成系统提示词快照
+        workspace.current_phase = "teaching"
+        workspace.bootstrap_snapshot = None
+        workspace_manager.save_workspace(workspace)
 
-    # 保存study_plan.md
-    plan_path = os.path.join(workspace.path, "study_plan.md")
-    with open(plan_path, "w", encoding="utf-8") as f:
-        f.write(study_plan)
+        yield sse_event({'done': True})
+        yield SSE_DONE
+
+    return workspace_sse_response(workspace, generate())
+
+
+def build_bootstrap_snapshot(workspace: Workspace) -> Dict[str, str]:
+    """采集教学阶段系统提示词中除工具列表外的固定输入"""
+    # 读取study_plan.md和agents.md（按mtime缓存）
+    study_plan = workspace_manager.read_cached(workspace.id, "study_plan.md")
+    agent_state = workspace_manager.read_cached(workspace.id, "agents.md")
+
+    # 压缩后的上下文
+    lesson_context = ""
+    if workspace.compressed_context:
+        lesson_context = (
+            f"[LESSON_CONTEXT - Compressed]\n{workspace.compressed_context}"
+        )
+
+    # 获取最近消息（保留最近5轮）
+    recent_exchanges = select_recent_exchanges(
+        workspace.messages[-10:], RECENT_EXCHANGES_CHAR_BUDGET
+    )
+
+    # 获取文件树
+    file_tree = workspace_manager.get_file_tree(workspace.id, limit=20)  # 限制数量
+    file_tree_str = "\n".join([f["path"] for f in file_tree])
+
+    return {
+        "study_plan": study_plan,
+        "agent_state": agent_state,
+        "lesson_context": lesson_context,
+        "recent_exchanges": recent_exchanges,
+        "file_tree": file_tree_str,
+    }
 
-    # 更新工作区阶段
-    workspace.current_phase = "teaching"
-    workspace_manager.save_workspace(workspace)
 
-    return jsonify({"success": True, "study_plan": study_plan})
+# 上下文压缩需要额外一次LLM调用，放到后台线程执行，不阻塞SSE流的结束
+_compression_executor = ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix="context-compress"
+)
+# 正在后台压缩的工作区ID，避免同一工作区重复提交
+_compressing_ids: set = set()
+_compressing_lock = threading.Lock()
+
+
+def schedule_context_compression(workspace: Workspace) -> bool:
+    """提交后台上下文压缩任务；该工作区已有任务在执行时返回False"""
+    with _compressing_lock:
+        if workspace.id in _compressing_ids:
+            return False
+        _compressing_ids.add(workspace.id)
+    # 压缩结果写回当前实例，完成前不能被移出内存
+    workspace_manager.acquire_workspace(workspace.id)
+
+    messages = list(compact_workspace_messages(workspace))
+
+    def compress():
+        try:
+            summary = llm_service.compress_context(
+                messages,
+                workspace_manager.read_cached(workspace.id, "study_plan.md"),
+                workspace_manager.read_cached(workspace.id, "agents.md"),
+            )
+            workspace.compressed_context = summary
+            # 压缩后的上下文需要进入系统提示词，下一轮重新生成快照
+            workspace.bootstrap_snapshot = None
+            workspace_manager.save_workspace(workspace)
+            logger.info(f"上下文压缩完成: {workspace.id}")
+        except Exception as e:
+            logger.error(f"后台上下文压缩失败: {str(e)}")
+        finally:
+            workspace_manager.release_workspace(workspace.id)
+            with _compressing_lock:
+                _compressing_ids.discard(workspace.id)
+
+    _compression_executor.submit(compress)
+    return True
 
 
 @app.route("/api/workspaces/<workspace_id>/chat", methods=["POST"])
@@ -1516,38 +2541,21 @@ def teaching_chat(workspace_id):
     user_input = data.get("message", "")
     tool_result = data.get("tool_result")  # 可选：待发送的工具结果（如练习反馈）
 
-    # 读取study_plan.md
-    study_plan_path = os.path.join(workspace.path, "study_plan.md")
-    study_plan = ""
-    if os.path.exists(study_plan_path):
-        with open(study_plan_path, "r", encoding="utf-8") as f:
-            study_plan = f.read()
-
-    # 读取agents.md
-    agents_path = os.path.join(workspace.path, "agents.md")
-    agent_state = ""
-    if os.path.exists(agents_path):
-        with open(agents_path, "r", encoding="utf-8") as f:
-            agent_state = f.read()
-
-    # 检查是否需要上下文压缩
-    lesson_context = ""
-    if workspace.compressed_context:
-        lesson_context = (
-            f"[LESSON_CONTEXT - Compressed]\n{workspace.compressed_context}"
-        )
-
-    # 获取最近消息（保留最近5轮）
-    recent_messages = (
-        workspace.messages[-10:] if len(workspace.messages) > 10 else workspace.messages
-    )
-    recent_exchanges = "\n".join(
-        [f"{m['role']}: {m['content'][:500]}" for m in recent_messages]
-    )
-
-    # 获取文件树
-    file_tree = workspace_manager.get_file_tree(workspace_id)
-    file_tree_str = "\n".join([f["path"] for f in file_tree[:20]])  # 限制数量
+    # 系统提示词中的学习计划、Agent状态、文件树等在每个会话开始时采集一次，
+    # 会话内各轮复用同一快照，保持提示词前缀不变。空闲过久、使用轮数达到上限、
+    # 上下文压缩或重新生成学习计划后开始新会话；快照不写盘，进程重启后也重新采集。
+    # 工具调用读写的仍是磁盘上的最新内容。
+    now = time.monotonic()
+    if (
+        workspace.bootstrap_snapshot is None
+        or workspace.bootstrap_turns >= BOOTSTRAP_MAX_TURNS
+        or now - workspace.bootstrap_used_at > BOOTSTRAP_IDLE_SECONDS
+    ):
+        workspace.bootstrap_snapshot = build_bootstrap_snapshot(workspace)
+        workspace.bootstrap_turns = 0
+    workspace.bootstrap_turns += 1
+    workspace.bootstrap_used_at = now
+    snapshot = workspace.bootstrap_snapshot
 
     # 检查搜索配置
     search_config = config_manager.get_search_config()
@@ -1559,31 +2567,34 @@ def teaching_chat(workspace_id):
     if search_enabled:
         available_tools += "\n- web_search: 搜索网络信息"
 
+    # 如果搜索功能已配置，提供web_search工具
+    teaching_tools = TEACHING_TOOLS_WITH_SEARCH if search_enabled else TEACHING_TOOLS
+
     # 使用提示词管理器构建系统提示词
     # 注意：为了保持KV Cache优化，不传入动态变化的token计数
     max_context = config_manager.get_model_max_context(llm_service.model) // 1000
     system_prompt = prompt_manager.get_teaching_prompt(
         max_context=max_context,
-        study_plan=study_plan,
-        agent_state=agent_state,
-        lesson_context=lesson_context,
-        recent_exchanges=recent_exchanges,
-        file_tree=file_tree_str,
+        study_plan=snapshot.get("study_plan", ""),
+        agent_state=snapshot.get("agent_state", ""),
+        lesson_context=snapshot.get("lesson_context", ""),
+        recent_exchanges=snapshot.get("recent_exchanges", ""),
+        file_tree=snapshot.get("file_tree", ""),
         available_tools=available_tools,
     )
 
     # 构建消息列表
     messages = [{"role": "system", "content": system_prompt}]
 
-    # 处理历史消息：将tool_calls字符串转换回数组格式
-    for msg in workspace.messages:
+    # 处理历史消息：将tool_calls字符串转换回数组格式（重复的工具结果替换为引用）
+    for msg in compact_workspace_messages(workspace):
         processed_msg = dict(msg)
         if "tool_calls" in processed_msg and isinstance(
             processed_msg["tool_calls"], str
         ):
             try:
-                processed_msg["tool_calls"] = json.loads(processed_msg["tool_calls"])
-            except json.JSONDecodeError:
+                processed_msg["tool_calls"] = loads_json(processed_msg["tool_calls"])
+            except ValueError:
                 # 如果解析失败，移除tool_calls字段
                 del processed_msg["tool_calls"]
         messages.append(processed_msg)
@@ -1597,7 +2608,7 @@ def teaching_chat(workspace_id):
                 msg.get("role") == "tool"
                 and msg.get("tool_call_id") == workspace.last_wait_call_id
             ):
-                msg["content"] = json.dumps(tool_result, ensure_ascii=False)
+                msg["content"] = dump_json_text(tool_result)
                 logger.info(
                     f"已更新工具结果到上下文: {tool_result.get('event', 'unknown')}"
                 )
@@ -1605,131 +2616,6 @@ def teaching_chat(workspace_id):
 
     messages.append({"role": "user", "content": user_input})
 
-    # 定义可用工具
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "wait_user_answer",
-                "description": "Call this tool at the end of EVERY response to indicate you are waiting for the user's input. This tool MUST be called after you finish speaking, even if you have called other tools. Do not call this tool before you finish your response.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {},
-                    "required": [],
-                },
-            },
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "generate_exercise",
-                "description": "Generate a practice exercise for the student. After calling this tool, you MUST continue the conversation based on the exercise generated, either by presenting the exercise to the student or asking if they are ready to answer.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "type": {
-                            "type": "string",
-                            "enum": [
-                                "fill_blank",
-                                "choice",
-                                "short_answer",
-                                "match",
-                                "multi_fill",
-                            ],
-                            "description": "The type of exercise: choice (multiple choice), fill_blank, short_answer, match, or multi_fill",
-                        },
-                        "question": {
-                            "type": "string",
-                            "description": "The complete question text. Must be detailed and clear.",
-                        },
-                        "options": {
-                            "type": "array",
-                            "items": {"type": "string"},
-                            "description": "For choice questions, provide at least 2 options. Required when type is 'choice'.",
-                        },
-                        "blanks": {
-                            "type": "array",
-                            "items": {"type": "string"},
-                            "description": "For fill_blank questions, list the blank positions. Required when type is 'fill_blank'.",
-                        },
-                        "correct_answers": {
-                            "type": "array",
-                            "items": {"type": "string"},
-                            "description": "Array of correct answers. Required for all question types.",
-                        },
-                        "explanation": {
-                            "type": "string",
-                            "description": "Detailed explanation of the answer. Must explain why the correct answer is right.",
-                        },
-                        "difficulty": {
-                            "type": "string",
-                            "enum": ["easy", "medium", "hard"],
-                            "description": "Difficulty level: easy, medium, or hard",
-                        },
-                    },
-                    "required": ["type", "question", "correct_answers", "explanation"],
-                },
-            },
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "file_system",
-                "description": "Read, write, edit, delete files or create directories in the workspace. After calling this tool, you MUST tell the user what you did with the file.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "action": {
-                            "type": "string",
-                            "enum": ["read", "write", "edit", "delete", "mkdir"],
-                            "description": "The operation to perform: 'read' (read file), 'write' (create/write file), 'edit' (modify file), 'delete' (remove file), 'mkdir' (create directory). Must be lowercase English.",
-                        },
-                        "path": {
-                            "type": "string",
-                            "description": "The file or directory path relative to the workspace root. Required.",
-                        },
-                        "content": {
-                            "type": "string",
-                            "description": "The content to write. Required when action is 'write'.",
-                        },
-                        "edit_instruction": {
-                            "type": "string",
-                            "description": "Edit instruction in format 'old_text->new_text'. Required when action is 'edit'.",
-                        },
-                    },
-                    "required": ["action", "path"],
-                },
-            },
-        },
-    ]
-
-    # 如果搜索功能已配置，添加web_search工具
-    if search_enabled:
-        tools.append(
-            {
-                "type": "function",
-                "function": {
-                    "name": "web_search",
-                    "description": "Search the web for information. After calling this tool, you MUST summarize the search results and continue the conversation.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "The search query. Must be specific and clear.",
-                            },
-                            "max_results": {
-                                "type": "integer",
-                                "default": 5,
-                                "description": "Maximum number of results to return (1-10)",
-                            },
-                        },
-                        "required": ["query"],
-                    },
-                },
-            }
-        )
-
     def generate():
         full_response = ""
         all_tool_results = []
@@ -1745,25 +2631,19 @@ def teaching_chat(workspace_id):
         while iteration < max_iterations:
             iteration += 1
             tool_calls_dict = {}
+            # 工具参数分片，流结束后再拼接
+            tool_args_parts: Dict[int, List[str]] = {}
+            batcher = ContentBatcher()
 
             # 调用LLM获取回复
-            for chunk in llm_service.chat_completion(
-                current_messages, stream=True, tools=tools
+            for data in llm_service.chat_completion(
+                current_messages, stream=True, tools=teaching_tools
             ):
-                if not chunk.startswith("data: "):
-                    continue
-
-                data_str = chunk[6:]
-                if data_str == "[DONE]":
-                    break
-
-                try:
-                    data = json.loads(data_str)
-                except:
-                    continue
-
                 if "error" in data:
-                    yield f"data: {json.dumps({'error': data['error']})}\n\n"
+                    pending = batcher.flush()
+                    if pending:
+                        yield sse_event({'content': pending})
+                    yield sse_event({'error': data['error']})
                     return
 
                 if "choices" in data and len(data["choices"]) > 0:
@@ -1787,23 +2667,22 @@ def teaching_chat(workspace_id):
                                 tool_calls_dict[tc_index]["type"] = tc["type"]
                             if "function" in tc:
                                 func = tc["function"]
-                                if "name" in func:
+                                # 部分服务在每个分片中重复发送名称（或发送null），只在首次出现时记录并通知
+                                if func.get("name") and not tool_calls_dict[tc_index][
+                                    "function"
+                                ].get("name"):
                                     tool_calls_dict[tc_index]["function"]["name"] = (
                                         func["name"]
                                     )
                                     tool_name = func["name"]
-                                    yield f"data: {json.dumps({'tool_call': {'name': tool_name, 'status': 'started'}})}\n\n"
+                                    pending = batcher.flush()
+                                    if pending:
+                                        yield sse_event({'content': pending})
+                                    yield sse_event({'tool_call': {'name': tool_name, 'status': 'started'}})
                                 if "arguments" in func:
-                                    if (
-                                        "arguments"
-                                        not in tool_calls_dict[tc_index]["function"]
-                                    ):
-                                        tool_calls_dict[tc_index]["function"][
-                                            "arguments"
-                                        ] = ""
-                                    tool_calls_dict[tc_index]["function"][
-                                        "arguments"
-                                    ] += func["arguments"]
+                                    tool_args_parts.setdefault(tc_index, []).append(
+                                        func["arguments"]
+                                    )
 
                     # 收集AI回复内容（不管是否有工具调用）
                     content = delta.get("content", "")
@@ -1811,7 +2690,17 @@ def teaching_chat(workspace_id):
                         full_response += content
                         # 只在第一次迭代流式输出到前端
                         if iteration == 1:
-                            yield f"data: {json.dumps({'content': content})}\n\n"
+                            batched = batcher.add(content)
+                            if batched:
+                                yield sse_event({'content': batched})
+
+            pending = batcher.flush()
+            if pending:
+                yield sse_event({'content': pending})
+
+            # 拼接完整的工具参数
+            for tc_index, parts in tool_args_parts.items():
+                tool_calls_dict[tc_index]["function"]["arguments"] = "".join(parts)
 
             # 如果没有工具调用，结束循环
             if not tool_calls_dict:
@@ -1823,6 +2712,21 @@ def teaching_chat(workspace_id):
             iteration_tool_results = []
             has_wait_tool = False
 
+            # 先并发发出本轮所有搜索请求，再按顺序收集结果
+            search_futures = {}
+            for tc_index in sorted_indexes:
+                tc = tool_calls_dict[tc_index]
+                if tc["function"].get("name") != "web_search":
+                    continue
+                tool_args_str = tc["function"].get("arguments", "")
+                try:
+                    tool_args_dict = loads_json(tool_args_str) if tool_args_str else {}
+                except json.JSONDecodeError:
+                    tool_args_dict = {}
+                search_futures[tc_index] = _search_executor.submit(
+                    tool_executor.execute, "web_search", tool_args_dict, workspace
+                )
+
             for tc_index in sorted_indexes:
                 tc = tool_calls_dict[tc_index]
                 tool_name = tc["function"].get("name", "")
@@ -1838,10 +2742,12 @@ def teaching_chat(workspace_id):
                     logger.info(
                         f"AI 调用 wait_user_answer，记录 call_id: {tool_call_id}"
                     )
+                elif tc_index in search_futures:
+                    tool_result = search_futures[tc_index].result()
                 else:
                     try:
                         tool_args_dict = (
-                            json.loads(tool_args_str) if tool_args_str else {}
+                            loads_json(tool_args_str) if tool_args_str else {}
                         )
                     except json.JSONDecodeError:
                         tool_args_dict = {}
@@ -1853,7 +2759,7 @@ def teaching_chat(workspace_id):
 
                     # 如果工具是generate_exercise，发送练习题数据
                     if tool_name == "generate_exercise" and "exercise" in tool_result:
-                        yield f"data: {json.dumps({'exercise': tool_result['exercise']})}\n\n"
+                        yield sse_event({'exercise': tool_result['exercise']})
 
                 iteration_tool_results.append(
                     {"id": tool_call_id, "name": tool_name, "result": tool_result}
@@ -1867,7 +2773,7 @@ def teaching_chat(workspace_id):
                 )
 
                 # 发送工具执行结果（wait_user_answer 也发送，但标记为 waiting 状态）
-                yield f"data: {json.dumps({'tool_call': {'name': tool_name, 'status': 'completed', 'result': tool_result}})}\n\n"
+                yield sse_event({'tool_call': {'name': tool_name, 'status': 'completed', 'result': tool_result}})
 
             # 保存到总列表
             all_tool_calls.extend(iteration_tool_calls)
@@ -1889,9 +2795,7 @@ def teaching_chat(workspace_id):
                     workspace.messages.append(
                         {
                             "role": "tool",
-                            "content": json.dumps(
-                                tool_info["result"], ensure_ascii=False
-                            ),
+                            "content": dump_json_text(tool_info["result"]),
                             "tool_call_id": tool_info["id"],
                         }
                     )
@@ -1911,7 +2815,7 @@ def teaching_chat(workspace_id):
                 current_messages.append(
                     {
                         "role": "tool",
-                        "content": json.dumps(tool_info["result"], ensure_ascii=False),
+                        "content": dump_json_text(tool_info["result"]),
                         "tool_call_id": tool_info["id"],
                     }
                 )
@@ -1930,34 +2834,21 @@ def teaching_chat(workspace_id):
             workspace.messages.append({"role": "user", "content": user_input})
             # assistant 消息已在循环中保存
 
-            # 更新token计数（估算）
-            workspace.token_count = sum(
-                len(m["content"]) // 4 for m in workspace.messages
-            )
+            # 更新token计数（估算，只累加本轮新增的消息）
+            compact_workspace_messages(workspace)
             workspace_manager.save_workspace(workspace)
 
-            yield f"data: {json.dumps({'done': True, 'token_count': workspace.token_count, 'waiting': True})}\n\n"
-            yield "data: [DONE]\n\n"
+            yield sse_event({'done': True, 'token_count': workspace.token_count, 'compressed': bool(workspace.compressed_context), 'waiting': True})
+            yield SSE_DONE
             return
 
         # 如果进行了普通工具调用，流式输出最后一次AI回复
         if all_tool_calls:
             follow_up_response = ""
-            for chunk in llm_service.chat_completion(
+            batcher = ContentBatcher()
+            for data in llm_service.chat_completion(
                 current_messages, stream=True, tools=None
             ):
-                if not chunk.startswith("data: "):
-                    continue
-
-                data_str = chunk[6:]
-                if data_str == "[DONE]":
-                    break
-
-                try:
-                    data = json.loads(data_str)
-                except:
-                    continue
-
                 if "error" in data:
                     logger.error(f"LLM后续调用错误: {data['error']}")
                     break
@@ -1968,7 +2859,13 @@ def teaching_chat(workspace_id):
                     content = delta.get("content", "")
                     if content:
                         follow_up_response += content
-                        yield f"data: {json.dumps({'content': content})}\n\n"
+                        batched = batcher.add(content)
+                        if batched:
+                            yield sse_event({'content': batched})
+
+            pending = batcher.flush()
+            if pending:
+                yield sse_event({'content': pending})
 
             # 保存完整对话历史
             workspace.messages.append({"role": "user", "content": user_input})
@@ -1983,7 +2880,7 @@ def teaching_chat(workspace_id):
                 workspace.messages.append(
                     {
                         "role": "tool",
-                        "content": json.dumps(tool_info["result"], ensure_ascii=False),
+                        "content": dump_json_text(tool_info["result"]),
                         "tool_call_id": tool_info["id"],
                     }
                 )
@@ -2003,9 +2900,7 @@ def teaching_chat(workspace_id):
                     workspace.messages.append(
                         {
                             "role": "tool",
-                            "content": json.dumps(
-                                tool_info["result"], ensure_ascii=False
-                            ),
+                            "content": dump_json_text(tool_info["result"]),
                             "tool_call_id": tool_info["id"],
                         }
                     )
@@ -2016,31 +2911,24 @@ def teaching_chat(workspace_id):
                     {"role": "assistant", "content": clean_content(full_response)}
                 )
 
-        # 更新token计数（估算）
-        workspace.token_count = sum(len(m["content"]) // 4 for m in workspace.messages)
+        # 更新token计数（估算，只累加本轮新增的消息，重复的工具结果按精简后计算）
+        compact_workspace_messages(workspace)
 
-        # 检查是否需要上下文压缩
+        workspace_manager.save_workspace(workspace)
+
+        # 检查是否需要上下文压缩（后台执行，下一轮对话使用压缩结果）
         if (
             workspace.token_count > workspace.token_threshold
             and not workspace.compressed_context
         ):
-            yield f"data: {json.dumps({'status': 'compressing_context'})}\n\n"
-            summary = llm_service.compress_context(
-                workspace.messages, study_plan, agent_state
-            )
-            workspace.compressed_context = summary
-            yield f"data: {json.dumps({'status': 'context_compressed'})}\n\n"
+            if schedule_context_compression(workspace):
+                yield sse_event({'status': 'compressing_context'})
 
-        workspace_manager.save_workspace(workspace)
-
-        yield f"data: {json.dumps({'done': True, 'token_count': workspace.token_count})}\n\n"
-        yield "data: [DONE]\n\n"
+        # 后台压缩完成后，之后各轮的done事件带有compressed标记
+        yield sse_event({'done': True, 'token_count': workspace.token_count, 'compressed': bool(workspace.compressed_context)})
+        yield SSE_DONE
 
-    return Response(
-        stream_with_context(generate()),
-        mimetype="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
-    )
+    return workspace_sse_response(workspace, generate())
 
 
 @app.route("/api/workspaces/<workspace_id>/messages", methods=["GET"])
@@ -2058,6 +2946,7 @@ def get_messages(workspace_id):
             "phase": workspace.current_phase,
             "token_count": workspace.token_count,
             "token_threshold": workspace.token_threshold,
+            "compressed": bool(workspace.compressed_context),
         }
     )
 
@@ -2082,17 +2971,49 @@ def read_file(workspace_id, file_path):
     if not workspace:
         return jsonify({"success": False, "error": "工作区不存在"}), 404
 
-    full_path = os.path.join(workspace.path, file_path)
-    if not os.path.exists(full_path):
+    # 确保路径安全（限制在工作区内）
+    full_path = resolve_workspace_path(workspace, file_path)
+    if full_path is None:
+        return jsonify({"success": False, "error": "非法路径"}), 403
+
+    try:
+        st = os.stat(full_path)
+    except OSError:
         return jsonify({"success": False, "error": "文件不存在"}), 404
 
+    # ?raw=1 直接返回文件本身，由send_file处理条件请求和sendfile。
+    # 文件内容可能由模型写入，一律按纯文本返回并禁止浏览器嗅探类型，避免被当作HTML执行
+    if request.args.get("raw"):
+        response = send_file(
+            full_path,
+            mimetype="text/plain",
+            conditional=True,
+            etag=True,
+            last_modified=st.st_mtime,
+        )
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        return response
+
+    # 以修改时间和大小作为ETag，文件未变化时返回304，不再读取和传输内容
+    etag = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    # 工作区文件可能很大，直接从磁盘读取而不放入进程级缓存；未变化的文件已由304处理
     try:
         with open(full_path, "r", encoding="utf-8") as f:
             content = f.read()
-        return jsonify({"success": True, "content": content, "path": file_path})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+    response = jsonify({"success": True, "content": content, "path": file_path})
+    response.set_etag(etag)
+    # 每次使用前向服务器验证ETag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 
 @app.route("/api/workspaces/<workspace_id>/export", methods=["GET"])
 @token_required
@@ -2102,37 +3023,46 @@ def export_conversation(workspace_id):
     if not workspace:
         return jsonify({"success": False, "error": "工作区不存在"}), 404
 
-    # 构建完整的导出数据
-    export_data = {
-        "metadata": {
-            "workspace_id": workspace.id,
-            "theme": workspace.theme,
-            "created_at": workspace.created_at,
-            "current_phase": workspace.current_phase,
-            "export_timestamp": datetime.now().isoformat(),
-            "version": "1.0",
-        },
-        "conversation": workspace.messages,
-        "study_plan": "",
-        "files": [],
+    # 导出时间戳和文件名共用同一个时间
+    now = datetime.now()
+    metadata = {
+        "workspace_id": workspace.id,
+        "theme": workspace.theme,
+        "created_at": workspace.created_at,
+        "current_phase": workspace.current_phase,
+        "export_timestamp": now.isoformat(),
+        "version": "1.0",
     }
+    # 先取消息列表快照，避免流式输出期间被新的对话修改
+    messages = list(workspace.messages)
+
+    def generate():
+        """逐段输出导出JSON，不在内存中拼出完整文档"""
+        yield b'{"metadata":' + dump_json_compact(metadata)
+        yield b',"conversation":['
+        first = True
+        for msg in messages:
+            if first:
+                first = False
+                yield dump_json_compact(msg)
+            else:
+                yield b"," + dump_json_compact(msg)
 
-    # 读取学习计划
-    study_plan_path = os.path.join(workspace.path, "study_plan.md")
-    if os.path.exists(study_plan_path):
-        with open(study_plan_path, "r", encoding="utf-8") as f:
-            export_data["study_plan"] = f.read()
+        # 读取学习计划
+        study_plan = workspace_manager.read_cached(workspace_id, "study_plan.md")
+        yield b'],"study_plan":' + dump_json_compact(study_plan)
 
-    # 获取文件列表
-    file_tree = workspace_manager.get_file_tree(workspace_id)
-    export_data["files"] = file_tree
+        # 获取文件列表
+        file_tree = workspace_manager.get_file_tree(workspace_id)
+        yield b',"files":' + dump_json_compact(file_tree) + b"}"
 
     # 设置响应头，触发文件下载
-    response = jsonify(export_data)
+    response = Response(
+        stream_with_context(generate()), mimetype="application/json"
+    )
     response.headers["Content-Disposition"] = (
-        f"attachment; filename=conversation-{workspace_id}-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        f"attachment; filename=conversation-{workspace_id}-{now.strftime('%Y%m%d_%H%M%S')}.json"
     )
-    response.headers["Content-Type"] = "application/json"
 
     return response
 
@@ -2162,13 +3092,10 @@ def get_exercise(workspace_id, exercise_id):
     if not workspace:
         return jsonify({"success": False, "error": "工作区不存在"}), 404
 
-    exercise_path = os.path.join(workspace.path, "exercises", f"{exercise_id}.json")
-    if not os.path.exists(exercise_path):
-        return jsonify({"success": False, "error": "练习题不存在"}), 404
-
     try:
-        with open(exercise_path, "r", encoding="utf-8") as f:
-            exercise = json.load(f)
+        exercise = workspace_manager.read_exercise(workspace_id, exercise_id)
+        if exercise is None:
+            return jsonify({"success": False, "error": "练习题不存在"}), 404
         return jsonify({"success": True, "exercise": exercise})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -2187,16 +3114,12 @@ def validate_exercise():
     if not workspace:
         return jsonify({"success": False, "error": "工作区不存在"}), 404
 
-    exercise_path = os.path.join(workspace.path, "exercises", f"{exercise_id}.json")
-    if not os.path.exists(exercise_path):
-        return jsonify({"success": False, "error": "练习题不存在"}), 404
-
     try:
-        with open(exercise_path, "r", encoding="utf-8") as f:
-            exercise = json.load(f)
+        meta = workspace_manager.read_exercise_meta(workspace_id, exercise_id)
+        if meta is None:
+            return jsonify({"success": False, "error": "练习题不存在"}), 404
 
-        correct_answers = exercise.get("correct_answers", [])
-        exercise_type = exercise.get("type", "choice")
+        exercise_type, correct_answers, explanation = meta
 
         # 客观题自动验证
         if exercise_type in ["choice", "fill_blank", "match", "multi_fill"]:
@@ -2206,7 +3129,7 @@ def validate_exercise():
                     "success": True,
                     "correct": is_correct,
                     "correct_answers": correct_answers,
-                    "explanation": exercise.get("explanation", ""),
+                    "explanation": explanation,
                 }
             )
         else:
@@ -2284,4 +3207,5 @@ if __name__ == "__main__":
     except Exception as e:
         logger.warning(f"自动打开浏览器失败: {e}")
 
-    app.run(host="0.0.0.0", port=5000, debug=False)
+    # 流式接口会在整个LLM回复期间占用一个线程，使用多线程处理并发请求
+    app.run(host="0.0.0.0", port=5000, debug=False, threaded=True)
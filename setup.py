@@ -91,10 +91,28 @@ def get_choice(prompt: str, options: Dict[str, str], default: Optional[str] = No
         print("  [错误] 无效选项，请重新选择")
 
 
+# 连接测试复用的HTTP会话（首次测试时创建）
+_http_session = None
+
+
+def get_http_session():
+    """获取复用连接的HTTP会话，多次测试同一服务时无需重新建立TCP/TLS连接"""
+    global _http_session
+    if _http_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        _http_session = requests.Session()
+        retries = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_maxsize=4, max_retries=retries)
+        _http_session.mount("https://", adapter)
+        _http_session.mount("http://", adapter)
+    return _http_session
+
+
 def test_llm_connection(config: Dict[str, Any]) -> bool:
     """测试LLM连接"""
-    import requests
-    
     print("\n  正在测试LLM连接...")
     try:
         headers = {
@@ -103,7 +121,7 @@ def test_llm_connection(config: Dict[str, Any]) -> bool:
         }
         
         # 尝试使用chat completions接口
-        response = requests.post(
+        response = get_http_session().post(
             f"{config['llm']['base_url'].rstrip('/')}/chat/completions",
             headers=headers,
             json={
@@ -4,4 +4,4 @@ WSGI entry point for AI Learning Assistant
 from app import app
 
 if __name__ == "__main__":
-    app.run()
+    app.run(threaded=True)